@@ -1,94 +1,306 @@
+import functools
 import os
+import re
+import shutil
 import tempfile
+import threading
+import time
 import uuid
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from markupsafe import escape
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-from pdf2image import convert_from_path
-import base64
+from src.utils.rendering import count_pages, render_pages, render_slide_png
+import orjson
+import pybase64
 from io import BytesIO
-from PIL import Image
 import boto3
-from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+import redis
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson and writes response bytes directly"""
+    
+    def _orjson_dumps(self, obj):
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        return orjson.dumps(obj, default=self.default, option=option)
+    
+    def dumps(self, obj, **kwargs):
+        return self._orjson_dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_dumps(obj), mimetype=self.mimetype)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 ALLOWED_EXTENSIONS = {'pdf'}
+# Render pool size; each pool process costs memory, so set this explicitly on small dynos
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS') or (
+    len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+))
+FILENAME_STRIP_RE = re.compile(r'[^\w\s-]')
+FILENAME_COLLAPSE_RE = re.compile(r'[-\s]+')
 
 # AWS S3 Configuration
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
 S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
+S3_UPLOAD_WORKERS = 16
+# Slide images above the threshold are sent as concurrent multipart chunks by a shared transfer manager
+S3_TRANSFER_CONFIG = TransferConfig(multipart_threshold=4 * 1024 * 1024, max_concurrency=8, use_threads=True)
+
+# Session Configuration
+REDIS_URL = os.getenv('REDIS_URL')
+SESSION_TTL_SECONDS = 3600
+SESSION_DIR_ROOT = os.path.join(tempfile.gettempdir(), 'slide-sessions')
 
-# In-memory session storage (use Redis/database in production)
+# Render process pool, shared by every request thread in this worker
+render_pool = None
+render_pool_lock = threading.Lock()
+
+# In-memory session storage, used when Redis is not configured (not shared between workers).
+# Maps session ID to (expiry timestamp, session data).
 session_storage = {}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@functools.lru_cache(maxsize=1)
+def create_s3_client():
+    """Create the S3 client once and share it across requests and upload threads"""
+    return boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION,
+        config=Config(
+            max_pool_connections=S3_UPLOAD_WORKERS + S3_TRANSFER_CONFIG.max_concurrency,
+            retries={'max_attempts': 3, 'mode': 'adaptive'}
+        )
+    )
+
+@functools.lru_cache(maxsize=1)
+def get_transfer_manager(s3_client):
+    """Create one transfer manager (and its thread pool) shared by all multipart uploads"""
+    return create_transfer_manager(s3_client, S3_TRANSFER_CONFIG)
+
 def get_s3_client():
     """Initialize S3 client"""
     try:
-        return boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION
-        )
+        return create_s3_client()
     except Exception as e:
         app.logger.error(f"Failed to initialize S3 client: {str(e)}")
         return None
 
+@functools.lru_cache(maxsize=1)
+def get_redis_client():
+    """Create the Redis client used for session storage"""
+    # Heroku Redis serves rediss:// with a self-signed certificate, which Heroku says to accept unverified
+    if REDIS_URL.startswith('rediss://'):
+        return redis.Redis.from_url(REDIS_URL, ssl_cert_reqs=None)
+    return redis.Redis.from_url(REDIS_URL)
+
+def save_session(session_id, session_data):
+    """Store session data in Redis with a TTL, or in memory when Redis is not configured"""
+    if REDIS_URL:
+        get_redis_client().set(f'session:{session_id}', json.dumps(session_data), ex=SESSION_TTL_SECONDS)
+    else:
+        session_storage[session_id] = (time.time() + SESSION_TTL_SECONDS, session_data)
+
+def load_session(session_id):
+    """Return stored session data, or None if the session doesn't exist or has expired"""
+    if REDIS_URL:
+        stored = get_redis_client().get(f'session:{session_id}')
+        return json.loads(stored) if stored else None
+    expires_at, session_data = session_storage.get(session_id, (0, None))
+    return session_data if expires_at > time.time() else None
+
+def delete_session(session_id):
+    """Remove stored session data"""
+    if REDIS_URL:
+        get_redis_client().delete(f'session:{session_id}')
+    else:
+        session_storage.pop(session_id, None)
+
+def sweep_expired_sessions():
+    """Drop expired in-memory sessions and local session directories older than the session TTL"""
+    now = time.time()
+    
+    for session_id, (expires_at, _) in list(session_storage.items()):
+        if expires_at <= now:
+            session_storage.pop(session_id, None)
+    
+    if not os.path.isdir(SESSION_DIR_ROOT):
+        return
+    
+    for entry in os.scandir(SESSION_DIR_ROOT):
+        try:
+            if entry.is_dir() and now - entry.stat().st_mtime > SESSION_TTL_SECONDS:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            continue
+
+def s3_public_url(s3_key):
+    """Return the public URL of an object in the S3 bucket"""
+    return f"https://{S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
+
+@functools.lru_cache(maxsize=1024)
 def sanitize_filename(text):
     """Sanitize text for use in filenames"""
-    import re
-    sanitized = re.sub(r'[^\w\s-]', '', text)
-    sanitized = re.sub(r'[-\s]+', '_', sanitized)
+    sanitized = FILENAME_STRIP_RE.sub('', text)
+    sanitized = FILENAME_COLLAPSE_RE.sub('_', sanitized)
     return sanitized.strip('_')
 
+def get_render_pool():
+    """Return the process pool shared by all requests in this worker, creating it on first use"""
+    global render_pool
+    with render_pool_lock:
+        if render_pool is None:
+            # Rendering holds the GIL, so use processes rather than threads to spread it across cores.
+            # forkserver children start from a clean single-threaded process instead of forking this one.
+            render_pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('forkserver')
+            )
+        return render_pool
+
+def discard_render_pool(pool):
+    """Shut down a broken render pool and stop handing it out, unless another thread already replaced it"""
+    global render_pool
+    with render_pool_lock:
+        if render_pool is pool:
+            render_pool = None
+    pool.shutdown(wait=False)
+
+def map_on_render_pool(fn, *iterables):
+    """Run fn over the render pool and return results in order, retrying once if a worker died"""
+    for attempt in range(2):
+        pool = get_render_pool()
+        try:
+            return list(pool.map(fn, *iterables))
+        except BrokenProcessPool:
+            # A crashed or OOM-killed child breaks the whole pool; replace it so later requests still work
+            discard_render_pool(pool)
+            if attempt:
+                raise
+            app.logger.warning("Render pool broke, retrying on a fresh pool")
+
+def render_thumbnails(pdf_path):
+    """Render a JPEG thumbnail for every page, split evenly across the render workers"""
+    # Even the page-count probe runs in the pool so request threads never call into PyMuPDF
+    page_count = map_on_render_pool(count_pages, [pdf_path])[0]
+    
+    # Thumbnails are only a few KB each, so one range per worker keeps every core busy even on short decks
+    range_size = max(1, -(-page_count // RENDER_WORKERS))
+    page_ranges = [range(start, min(start + range_size, page_count))
+                   for start in range(0, page_count, range_size)]
+    
+    rendered = map_on_render_pool(render_pages, repeat(pdf_path), page_ranges)
+    return [thumbnail for thumbnails in rendered for thumbnail in thumbnails]
+
 def convert_pdf_to_images(pdf_path):
-    """Convert PDF to images and return slide data with stored images"""
+    """Convert PDF pages to JPEG thumbnails, one per page in order"""
     try:
-        images = convert_from_path(pdf_path, dpi=150, fmt='PNG')
+        return render_thumbnails(pdf_path)
+    except Exception as e:
+        app.logger.error(f"Error converting PDF: {str(e)}")
+        return []
+
+def thumbnail_data_uri(thumbnail):
+    """Encode a JPEG thumbnail as a base64 data URI"""
+    return f"data:image/jpeg;base64,{pybase64.b64encode(thumbnail).decode('ascii')}"
+
+def upload_thumbnails(s3_client, session_id, thumbnails):
+    """Upload JPEG thumbnails to S3 concurrently and return their public URLs in order"""
+    def upload_thumbnail(index):
+        s3_key = f"thumbs/{session_id}/{index + 1}.jpg"
+        s3_client.put_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=s3_key,
+            Body=thumbnails[index],
+            ContentType='image/jpeg',
+            ACL='public-read'
+        )
+        return s3_public_url(s3_key)
+    
+    with ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS) as executor:
+        return list(executor.map(upload_thumbnail, range(len(thumbnails))))
+
+def fetch_session_pdf(s3_client, session_data, work_dir):
+    """Return a local path to the session's PDF, downloading it from S3 staging if needed"""
+    if 'staging_key' not in session_data:
+        return session_data['pdf_path']
+    
+    pdf_path = os.path.join(work_dir, 'upload.pdf')
+    s3_client.download_file(S3_BUCKET_NAME, session_data['staging_key'], pdf_path)
+    return pdf_path
+
+def upload_slide_image(s3_client, image_data, filename, s3_key):
+    """Upload a rendered slide image to S3 and return (filename, s3_key, s3_url)"""
+    app.logger.debug("Uploading slide image to S3: %s", s3_key)
+    
+    extra_args = {'ContentType': 'image/png', 'ACL': 'public-read'}
+    
+    # Most slides fit in a single PUT; only large images go through the multipart transfer manager
+    if len(image_data) < S3_TRANSFER_CONFIG.multipart_threshold:
+        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=s3_key, Body=image_data, **extra_args)
+    else:
+        get_transfer_manager(s3_client).upload(
+            BytesIO(image_data), S3_BUCKET_NAME, s3_key, extra_args=extra_args
+        ).result()
+    
+    return filename, s3_key, s3_public_url(s3_key)
+
+def generate_html(uploaded_slides):
+    """Build an HTML section for each category of uploaded slides"""
+    html_sections = {}
+    
+    for category, slides in uploaded_slides.items():
+        # Sanitize category name for CSS class to prevent HTML generation errors
+        safe_category = sanitize_filename(category.lower()) if category else 'uncategorized'
         
-        slides = []
-        temp_images = []
+        # Escape the user-supplied category once rather than per slide
+        escaped_category = escape(category)
         
-        for i, image in enumerate(images):
-            # Create thumbnail for preview
-            thumbnail = image.copy()
-            thumbnail.thumbnail((300, 200), Image.Resampling.LANCZOS)
-            
-            # Convert thumbnail to base64
-            buffer = BytesIO()
-            thumbnail.save(buffer, format='PNG')
-            thumbnail_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            # Store full-size image in memory for later S3 upload
-            full_buffer = BytesIO()
-            image.save(full_buffer, format='PNG')
-            full_image_data = full_buffer.getvalue()
-            
-            slide_data = {
-                'id': i + 1,
-                'thumbnail': f'data:image/png;base64,{thumbnail_b64}',
-                'title': f'Slide {i + 1}',
-                'selected': False,
-                'category': None
-            }
-            
-            slides.append(slide_data)
-            temp_images.append(full_image_data)
+        html_parts = [
+            f'<!-- {escaped_category} Section -->',
+            f'<div class="{safe_category}-section">',
+            f'  <h2>{escaped_category}</h2>',
+            '  <div class="slides-container">'
+        ]
         
-        return slides, temp_images
-    except Exception as e:
-        app.logger.error(f"Error converting PDF: {str(e)}")
-        return [], []
+        for slide in slides:
+            html_parts.append(
+                '    <div class="slide-item">\n'
+                f'      <img src="{escape(slide["s3_url"])}" alt="{escaped_category}_slide{slide["id"]}" />\n'
+                f'      <p>Slide {slide["id"]}</p>\n'
+                '    </div>'
+            )
+        
+        html_parts.append('  </div>')
+        html_parts.append('</div>')
+        
+        html_sections[category] = '\n'.join(html_parts)
+    
+    return html_sections
 
 @app.route('/')
 def home():
@@ -154,40 +366,79 @@ def upload_pdf():
         if not allowed_file(file.filename):
             return jsonify({'error': 'Invalid file type. Only PDF files are allowed.'}), 400
         
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
+        # Remove local PDFs left behind by sessions that were never processed
+        sweep_expired_sessions()
         
-        if file_size > app.config['MAX_CONTENT_LENGTH']:
-            return jsonify({'error': 'File size exceeds 50MB limit'}), 400
+        # Keep the PDF so full-size images are only rendered for selected slides
+        os.makedirs(SESSION_DIR_ROOT, exist_ok=True)
+        session_dir = tempfile.mkdtemp(prefix='slides_', dir=SESSION_DIR_ROOT)
+        pdf_path = os.path.join(session_dir, 'upload.pdf')
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            file.save(temp_file.name)
-            
-            # Process PDF and get slide data + images
-            slides, temp_images = convert_pdf_to_images(temp_file.name)
-            
-            # Clean up temp PDF file
-            os.unlink(temp_file.name)
+        file.save(pdf_path)
+        
+        # Process PDF and get slide thumbnails
+        thumbnails = convert_pdf_to_images(pdf_path)
         
-        if not slides:
+        if not thumbnails:
+            shutil.rmtree(session_dir, ignore_errors=True)
             return jsonify({'error': 'Failed to process PDF'}), 500
         
         # Generate session ID and store data
         session_id = str(uuid.uuid4())
         
-        # Store session data including images for later S3 upload
-        session_storage[session_id] = {
-            'slides': slides,
-            'temp_images': temp_images,
+        session_data = {
+            'page_count': len(thumbnails),
             'fund_id': fund_id,
             'fund_name': fund_name,
             'safe_fund_id': sanitize_filename(fund_id),
             'safe_fund_name': sanitize_filename(fund_name)
         }
         
+        # Stage the PDF in S3 so any worker can process the session; fall back to local disk
+        s3_client = get_s3_client() if all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, S3_BUCKET_NAME]) else None
+        if s3_client:
+            staging_key = f"staging/{session_id}/upload.pdf"
+            try:
+                s3_client.upload_file(pdf_path, S3_BUCKET_NAME, staging_key)
+            finally:
+                shutil.rmtree(session_dir, ignore_errors=True)
+            session_data['staging_key'] = staging_key
+        else:
+            session_data['pdf_path'] = pdf_path
+            session_data['session_dir'] = session_dir
+        
+        try:
+            save_session(session_id, session_data)
+        except Exception:
+            # Without a session nothing can reach the staged PDF, so don't leave it behind
+            if 'staging_key' in session_data:
+                s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=session_data['staging_key'])
+            else:
+                shutil.rmtree(session_dir, ignore_errors=True)
+            raise
+        
+        # Serve thumbnails from S3 unless inline data URIs are requested or S3 isn't configured
+        thumbnail_srcs = None
+        if s3_client and request.args.get('inline') != '1':
+            try:
+                thumbnail_srcs = upload_thumbnails(s3_client, session_id, thumbnails)
+            except (ClientError, BotoCoreError) as e:
+                app.logger.error(f"S3 thumbnail upload error, falling back to inline thumbnails: {str(e)}")
+        
+        if thumbnail_srcs is None:
+            thumbnail_srcs = [thumbnail_data_uri(thumbnail) for thumbnail in thumbnails]
+        
+        slides = [
+            {
+                'id': i + 1,
+                'thumbnail': thumbnail_src,
+                'title': f'Slide {i + 1}',
+                'selected': False,
+                'category': None
+            }
+            for i, thumbnail_src in enumerate(thumbnail_srcs)
+        ]
+        
         app.logger.info(f"PDF processed successfully. Session: {session_id}, Slides: {len(slides)}")
         
         return jsonify({
@@ -199,6 +450,9 @@ def upload_pdf():
             'total_slides': len(slides)
         })
     
+    except RequestEntityTooLarge:
+        # Let the 413 handler answer oversized uploads rejected while parsing the form
+        raise
     except Exception as e:
         app.logger.error(f"Error processing upload: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -216,11 +470,10 @@ def process_slides():
         if not session_id or not selected_slides:
             return jsonify({'error': 'Missing session ID or selected slides'}), 400
         
-        if session_id not in session_storage:
+        session_data = load_session(session_id)
+        if not session_data:
             return jsonify({'error': 'Session not found or expired'}), 404
         
-        session_data = session_storage[session_id]
-        
         # Check AWS configuration
         if not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, S3_BUCKET_NAME]):
             app.logger.error("AWS not configured properly")
@@ -233,8 +486,8 @@ def process_slides():
         
         app.logger.info(f"S3 client initialized. Uploading {len(selected_slides)} slides...")
         
-        # Process selected slides
-        uploaded_slides = {}
+        # Collect the uploads for the selected slides
+        upload_tasks = []
         
         for selected_slide in selected_slides:
             slide_id = selected_slide.get('id')
@@ -243,79 +496,81 @@ def process_slides():
             if not slide_id or not category:
                 continue
             
-            # Get the image data for this slide
             image_index = slide_id - 1  # Convert to 0-based index
-            if image_index >= len(session_data['temp_images']):
+            if image_index >= session_data['page_count']:
                 continue
             
-            image_data = session_data['temp_images'][image_index]
-            
-            # Generate S3 filename
-            safe_fund_id = session_data['safe_fund_id']
-            safe_fund_name = session_data['safe_fund_name']
-            filename = f"{safe_fund_id}_{safe_fund_name}_slide{slide_id}.png"
-            s3_key = f"presentations/{session_id}/{filename}"
+            upload_tasks.append((slide_id, category))
+        
+        # Render selected slides on the process pool (PyMuPDF isn't thread-safe) and only
+        # overlap the S3 uploads on threads, since those are dominated by round-trip latency
+        slide_ids = list(dict.fromkeys(slide_id for slide_id, _ in upload_tasks))
+        filename_prefix = f"{session_data['safe_fund_id']}_{session_data['safe_fund_name']}"
+        
+        work_dir = tempfile.mkdtemp(prefix='slides_')
+        try:
+            pdf_path = fetch_session_pdf(s3_client, session_data, work_dir)
+            page_numbers = [slide_id - 1 for slide_id in slide_ids]
+            rendered_slides = map_on_render_pool(render_slide_png, repeat(pdf_path), page_numbers)
             
-            try:
-                app.logger.info(f"Uploading slide {slide_id} to S3: {s3_key}")
-                
-                # Upload to S3
-                s3_client.put_object(
-                    Bucket=S3_BUCKET_NAME,
-                    Key=s3_key,
-                    Body=image_data,
-                    ContentType='image/png',
-                    ACL='public-read'
-                )
-                
-                # Generate public URL
-                s3_url = f"https://{S3_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
-                
-                # Group by category
-                if category not in uploaded_slides:
-                    uploaded_slides[category] = []
-                
-                uploaded_slides[category].append({
-                    'id': slide_id,
-                    'filename': filename,
-                    's3_url': s3_url,
-                    's3_key': s3_key
-                })
+            with ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS) as executor:
+                futures = {}
+                uploads_by_hash = {}
                 
-                app.logger.info(f"Successfully uploaded slide {slide_id} to S3: {s3_url}")
-                
-            except ClientError as e:
-                app.logger.error(f"S3 upload error for slide {slide_id}: {str(e)}")
-                return jsonify({'error': f'Failed to upload slide {slide_id} to S3: {str(e)}'}), 500
+                for slide_id, (image_data, content_hash) in zip(slide_ids, rendered_slides):
+                    # Identical slides (repeated title/section pages) share a single S3 object
+                    if content_hash not in uploads_by_hash:
+                        filename = f"{filename_prefix}_{content_hash}.png"
+                        s3_key = f"presentations/{session_id}/{filename}"
+                        uploads_by_hash[content_hash] = executor.submit(
+                            upload_slide_image, s3_client, image_data, filename, s3_key
+                        )
+                    futures[slide_id] = uploads_by_hash[content_hash]
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
         
-        # Generate HTML with real S3 URLs
-        html_sections = {}
+        uploaded_slides = {}
+        failed_slides = {}
         
-        for category, slides in uploaded_slides.items():
-            # Sanitize category name for CSS class to prevent HTML generation errors
-            safe_category = sanitize_filename(category.lower()) if category else 'uncategorized'
-            
-            html_parts = []
-            html_parts.append(f'<!-- {category} Section -->')
-            html_parts.append(f'<div class="{safe_category}-section">')
-            html_parts.append(f'  <h2>{category}</h2>')
-            html_parts.append('  <div class="slides-container">')
+        for slide_id, category in upload_tasks:
+            try:
+                filename, s3_key, s3_url = futures[slide_id].result()
+            except ClientError as e:
+                if slide_id not in failed_slides:
+                    app.logger.error(f"S3 upload error for slide {slide_id}: {str(e)}")
+                    failed_slides[slide_id] = {'id': slide_id, 'error': str(e)}
+                continue
             
-            for slide in slides:
-                html_parts.append('    <div class="slide-item">')
-                html_parts.append(f'      <img src="{slide["s3_url"]}" alt="{category}_slide{slide["id"]}" />')
-                html_parts.append(f'      <p>Slide {slide["id"]}</p>')
-                html_parts.append('    </div>')
+            # Group by category
+            if category not in uploaded_slides:
+                uploaded_slides[category] = []
             
-            html_parts.append('  </div>')
-            html_parts.append('</div>')
+            uploaded_slides[category].append({
+                'id': slide_id,
+                'filename': filename,
+                's3_url': s3_url,
+                's3_key': s3_key
+            })
             
-            html_sections[category] = '\n'.join(html_parts)
+            app.logger.debug("Uploaded slide %s to S3: %s", slide_id, s3_url)
+        
+        if failed_slides:
+            return jsonify({
+                'error': f'Failed to upload {len(failed_slides)} slide(s) to S3',
+                'failed_slides': list(failed_slides.values())
+            }), 500
+        
+        # Generate HTML with real S3 URLs
+        html_sections = generate_html(uploaded_slides)
         
         app.logger.info(f"Generated HTML for {len(uploaded_slides)} categories")
         
-        # Clean up session data
-        del session_storage[session_id]
+        # Clean up session data and the staged PDF
+        delete_session(session_id)
+        if 'staging_key' in session_data:
+            s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=session_data['staging_key'])
+        else:
+            shutil.rmtree(session_data['session_dir'], ignore_errors=True)
         
         return jsonify({
             'success': True,
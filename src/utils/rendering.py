@@ -0,0 +1,64 @@
+"""PDF page rendering, run in the render process pool.
+
+Only fitz and PIL are imported here so pool workers don't load the Flask app.
+"""
+import hashlib
+from io import BytesIO
+
+import fitz
+from PIL import Image
+
+THUMBNAIL_SIZE = (300, 200)
+THUMBNAIL_JPEG_QUALITY = 80
+MAX_RENDER_DPI = 150
+FULL_SIZE_MAX_WIDTH = 1600  # Width cap for the full-size slide image uploaded to S3
+PNG_COMPRESS_LEVEL = 1  # Fastest zlib level; slightly larger files cost far less than deflate CPU
+
+def count_pages(pdf_path):
+    """Return the number of pages in a PDF"""
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+def render_pages(pdf_path, page_numbers):
+    """Render JPEG thumbnails for a range of PDF pages"""
+    # Each worker opens its own document since MuPDF documents can't be shared across workers
+    doc = fitz.open(pdf_path)
+    try:
+        thumbnails = []
+        
+        for i in page_numbers:
+            page = doc.load_page(i)
+            
+            # Render the preview directly at thumbnail resolution instead of downsampling the full page
+            thumb_zoom = min(THUMBNAIL_SIZE[0] / page.rect.width, THUMBNAIL_SIZE[1] / page.rect.height)
+            thumb_pix = page.get_pixmap(matrix=fitz.Matrix(thumb_zoom, thumb_zoom), alpha=False)
+            buffer = BytesIO()
+            with Image.frombuffer("RGB", (thumb_pix.width, thumb_pix.height), thumb_pix.samples_mv, "raw", "RGB", 0, 1) as thumbnail:
+                thumbnail.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+                thumbnail.save(buffer, format='JPEG', quality=THUMBNAIL_JPEG_QUALITY, optimize=False, progressive=False)
+            thumbnails.append(buffer.getvalue())
+            
+            # The PIL copy is freed when the with block closes it; drop the pixmap's raster too
+            del thumb_pix, page
+        
+        return thumbnails
+    finally:
+        doc.close()
+
+def render_slide_png(pdf_path, page_number):
+    """Render a single PDF page at full size and return its PNG bytes and content hash"""
+    with fitz.open(pdf_path) as doc:
+        page = doc.load_page(page_number)
+        zoom = min(MAX_RENDER_DPI / 72, FULL_SIZE_MAX_WIDTH / page.rect.width)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    
+    # samples_mv skips the intermediate bytes copy of Pixmap.samples; Pillow still copies RGB data into its own buffer
+    buffer = BytesIO()
+    with Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", 0, 1) as image:
+        image.save(buffer, format='PNG', optimize=False, compress_level=PNG_COMPRESS_LEVEL)
+    
+    # Drop the pixmap's raster before returning, since the PIL image held its own copy
+    del pix
+    
+    image_data = buffer.getvalue()
+    return image_data, hashlib.blake2b(image_data, digest_size=16).hexdigest()